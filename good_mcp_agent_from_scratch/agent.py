@@ -1,28 +1,165 @@
 import subprocess
+import sys
 import json
 import asyncio
-from typing import Dict, Any, List
+import itertools
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional
 import openai
 
+try:
+    import orjson
+except ImportError:  # ⭐ 没装 orjson 时回退到标准库
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # ⭐ 可选：只有超大单行响应才用得上
+    ijson = None
+
+
+def _loads(data: bytes) -> Any:
+    # orjson 直接解析 bytes，省掉一次 .decode()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj: Any) -> bytes:
+    # orjson 直接输出 bytes，省掉一次 .encode()
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def _dumps_line(obj: Any) -> bytes:
+    # ⭐ 换行由 orjson 在同一次分配里追加，不再额外 + b"\n"
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj) + "\n").encode()
+
+
+# ⭐ tools/call 信封的固定部分预先编码，每次只序列化 name / arguments / id
+_CALL_HEAD = b'{"jsonrpc":"2.0","method":"tools/call","params":{"name":'
+_CALL_ARGS = b',"arguments":'
+_CALL_ID = b'},"id":'
+
+
+def _call_frame(request_id: int, tool_name: str, arguments: Dict) -> bytes:
+    return b"".join(
+        (
+            _CALL_HEAD,
+            _dumps(tool_name),
+            _CALL_ARGS,
+            _dumps(arguments),
+            _CALL_ID,
+            str(request_id).encode(),
+            b"}\n",
+        )
+    )
+
+
+# ⭐ LLM 输出解析器：raw_decode 只扫描一次，并允许 JSON 后面跟着说明文字
+_DECODER = json.JSONDecoder()
+
+# ⭐ 出站批量写：单批字节上限，随 in-flight 请求数自适应增长
+_BATCH_MIN_BYTES = 64 * 1024
+_BATCH_MAX_BYTES = 1024 * 1024
+
+# ⭐ stdout 每次读取的块大小
+_READ_CHUNK = 64 * 1024
+
+# ⭐ 单行超过这个大小还没收到换行，就改成边收边解析（需要 ijson）
+_STREAM_THRESHOLD = 256 * 1024
+
+# ⭐ 定时任务周期（秒）
+_HEARTBEAT_INTERVAL = 5
+_METRICS_INTERVAL = 10
+
+# ⭐ stop() 等待后台任务退出的上限（秒）
+_SHUTDOWN_TIMEOUT = 1.0
+
+# ⭐ 请求槽位初始数量（2 的幂，在途请求过半时翻倍）
+_INITIAL_SLOTS = 1024
+
+# ⭐ prompt 固定后缀（前缀依赖工具列表，在 _initialize 里算一次）
+_PROMPT_SUFFIX = """
+
+如果需要使用工具，请返回JSON：
+{"tool": "...", "args": {}}
+否则直接回答。
+"""
+
+
+class _LineStream:
+    # ⭐ 超大单行 JSON：数据一到就喂给 ijson，收到换行时解析已基本完成
+    def __init__(self):
+        self._items = ijson.sendable_list()
+        self._coro = ijson.items_coro(self._items, "", use_float=True)
+        self._error: Optional[Exception] = None
+
+    def feed(self, data: bytes):
+        if self._error is None:
+            try:
+                self._coro.send(data)
+            except Exception as e:
+                self._error = e
+
+    def finish(self) -> Any:
+        if self._error is None:
+            try:
+                self._coro.close()
+            except Exception as e:
+                self._error = e
+        if self._error is not None:
+            raise self._error
+        return self._items[0]
+
 
 class ManualMCPAgent:
-    def __init__(self, server_module: str):
+    # ⭐ ping 帧是常量，预先编码好直接写
+    _PING_FRAME = b'{"type":"ping"}\n'
+
+    def __init__(self, server_module: str, debug: bool = False):
         self.server_module = server_module
         self.process = None
-        self.tools: List[Dict] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.tools: List[SimpleNamespace] = []
+        self.tool_names: List[str] = []
+        self.tools_desc_str = ""
+        self._prompt_prefix = ""
 
         # ⭐ background task 管理
         self._tasks: List[asyncio.Task] = []
         self._running = False
 
+        # ⭐ 存活计数：只在 debug 时输出到 stderr，不跟 stdout 抢锁
+        self._debug = debug
+        self._alive_ticks = 0
+
         # ⭐ request-response 同步
-        self._pending_requests: Dict[int, asyncio.Future] = {}
-        self._request_id = 0
+        # ⭐ id 单调递增（会话内不复用），槽位 = id & mask，槽里存 (id, future)
+        self._ids = itertools.count(1)
+        self._slots: List[Optional[tuple]] = [None] * _INITIAL_SLOTS
+        self._mask = _INITIAL_SLOTS - 1
+        self._pending = 0
+
+        # ⭐ 连接断开后记下原因：之后的请求直接抛出，不再排队等永远不会来的响应
+        self._conn_error: Optional[BaseException] = None
+
+        # ⭐ 出站队列：同一轮事件循环里产生的帧合并成一次 write + drain
+        self._out_queue: asyncio.Queue[bytes] = asyncio.Queue()
+
+        # ⭐ 异步 LLM client：HTTP 往返期间不阻塞事件循环
+        self._oai = openai.AsyncOpenAI()
 
     # ==============================
     # Lifecycle
     # ==============================
     async def start_server(self):
+        # ⭐ 缓存事件循环，热路径上 create_future 不再查 running loop
+        self._loop = asyncio.get_running_loop()
+
         self.process = await asyncio.create_subprocess_exec(
             "python",
             "-m",
@@ -35,9 +172,9 @@ class ManualMCPAgent:
         self._running = True
 
         # ⭐ 启动后台 worker
+        self._tasks.append(asyncio.create_task(self._stdin_writer()))
         self._tasks.append(asyncio.create_task(self._stdout_listener()))
-        self._tasks.append(asyncio.create_task(self._heartbeat()))
-        self._tasks.append(asyncio.create_task(self._metrics_pusher()))
+        self._tasks.append(asyncio.create_task(self._periodic()))
 
         await self._initialize()
 
@@ -47,62 +184,155 @@ class ManualMCPAgent:
         for t in self._tasks:
             t.cancel()
 
-        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # ⭐ 带 deadline 等待：某个任务吞掉 CancelledError 也不会让 stop 卡死
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=_SHUTDOWN_TIMEOUT)
+            for t in pending:
+                t.cancel()
+            if pending:
+                await asyncio.wait(pending, timeout=0.1)
+            self._tasks.clear()
 
         if self.process:
-            self.process.kill()
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass  # ⭐ server 已经自己退出了
             await self.process.wait()
 
     # ==============================
     # Background Workers
     # ==============================
-    async def _stdout_listener(self):
-        """持续读取 MCP server 输出"""
+    async def _stdin_writer(self):
+        """把排队的出站帧批量写入 MCP server stdin"""
         while self._running:
             try:
-                line = await self.process.stdout.readline()
-                if not line:
-                    break
-
-                msg = json.loads(line.decode())
+                first = await self._out_queue.get()
+                buf = bytearray(first)
 
-                # ⭐ 处理 response
-                if "id" in msg and msg["id"] in self._pending_requests:
-                    fut = self._pending_requests.pop(msg["id"])
-                    if not fut.done():
-                        fut.set_result(msg)
+                # ⭐ in-flight 越多，批次越大（每 16 个请求多一档）
+                cap = min(
+                    _BATCH_MAX_BYTES,
+                    _BATCH_MIN_BYTES * (1 + self._inflight() // 16),
+                )
+                while not self._out_queue.empty() and len(buf) < cap:
+                    buf += self._out_queue.get_nowait()
 
-                # ⭐ 处理 server push event（如果有）
-                elif msg.get("method"):
-                    print("[Server Event]", msg)
+                self.process.stdin.write(buf)
+                await self.process.stdin.drain()
 
             except asyncio.CancelledError:
                 break
+            except (ConnectionResetError, BrokenPipeError) as e:
+                # ⭐ server 已经退出：在途请求都等不到响应了，全部失败并停止写
+                print("stdin writer error:", e)
+                self._fail_pending(e)
+                break
             except Exception as e:
-                print("stdout listener error:", e)
+                print("stdin writer error:", e)
+
+    def _fail_pending(self, exc: BaseException):
+        self._conn_error = exc
+        for entry in self._slots:
+            if entry is not None and not entry[1].done():
+                entry[1].set_exception(exc)
+        self._slots = [None] * len(self._slots)
+        self._pending = 0
 
-    async def _heartbeat(self):
+        # ⭐ 队列里剩下的帧已经没人写了
+        while not self._out_queue.empty():
+            self._out_queue.get_nowait()
+
+    async def _stdout_listener(self):
+        """持续读取 MCP server 输出"""
+        # ⭐ 大块读入，整个生命周期复用同一个 bytearray，在用户态按 \n 切行
+        buf = bytearray()
+        stream: Optional[_LineStream] = None
         while self._running:
             try:
-                if self.process:
-                    ping = {"type": "ping"}
-                    self.process.stdin.write((json.dumps(ping) + "\n").encode())
-                    await self.process.stdin.drain()
-
+                chunk = await self.process.stdout.read(_READ_CHUNK)
+                if not chunk:
+                    # ⭐ server 退出：已经写出去的请求也等不到响应了
+                    self._fail_pending(ConnectionResetError("MCP server closed stdout"))
+                    break
+            except asyncio.CancelledError:
+                break
             except Exception as e:
-                print("heartbeat error:", e)
-
-            await asyncio.sleep(5)
+                print("stdout listener error:", e)
+                continue
+
+            # ⭐ 正在流式解析一条超大响应：换行之前的数据都直接喂给它
+            if stream is not None:
+                nl = chunk.find(b"\n")
+                if nl == -1:
+                    stream.feed(chunk)
+                    continue
+
+                stream.feed(chunk[:nl])
+                try:
+                    self._dispatch(stream.finish())
+                except Exception as e:
+                    print("stdout listener error:", e)
+                stream = None
+                chunk = chunk[nl + 1 :]
+
+            buf += chunk
+            while (nl := buf.find(b"\n")) != -1:
+                line = bytes(buf[:nl])
+                del buf[: nl + 1]
+
+                try:
+                    self._dispatch(_loads(line))
+                except Exception as e:
+                    print("stdout listener error:", e)
+
+            # ⭐ 迟迟等不到换行：改成边收边解析，不再把整行攒在内存里再一次性解析
+            if ijson is not None and len(buf) > _STREAM_THRESHOLD:
+                stream = _LineStream()
+                stream.feed(buf)
+                buf.clear()
+
+    def _dispatch(self, msg: Dict):
+        # ⭐ 处理 response（最常见的情况放前面，只查一次槽位）
+        rid = msg.get("id")
+        fut = self._release_slot(rid) if rid is not None else None
+        if fut is not None:
+            if not fut.done():
+                fut.set_result(msg)
+
+        # ⭐ 处理 server push event（如果有）
+        elif "method" in msg:
+            print("[Server Event]", msg)
+
+    async def _periodic(self):
+        """心跳 + 指标合并成一个定时循环，只 sleep 到最近的 deadline"""
+        loop = asyncio.get_running_loop()
+        next_hb = next_mx = loop.time()
 
-    async def _metrics_pusher(self):
         while self._running:
-            try:
-                print("[Metrics] agent alive")
+            now = loop.time()
 
-            except Exception as e:
-                print("metrics error:", e)
+            if now >= next_hb:
+                try:
+                    self._write_ping_nowait()
+                except Exception as e:
+                    print("heartbeat error:", e)
+                next_hb = now + _HEARTBEAT_INTERVAL
 
-            await asyncio.sleep(10)
+            if now >= next_mx:
+                self._alive_ticks += 1
+                if self._debug:
+                    sys.stderr.write(f"[Metrics] agent alive {self._alive_ticks}\n")
+                next_mx = now + _METRICS_INTERVAL
+
+            await asyncio.sleep(min(next_hb, next_mx) - now)
+
+    def _write_ping_nowait(self):
+        # ⭐ ping 丢了无所谓：直接交给 transport，不进出站队列，也不走 drain 流控
+        if self.process:
+            transport = self.process.stdin.transport
+            if not transport.is_closing():
+                transport.write(self._PING_FRAME)
 
     # ==============================
     # MCP RPC
@@ -114,30 +344,88 @@ class ManualMCPAgent:
         }
 
         response = await self._send_request(request)
-        self.tools = response.get("result", {}).get("tools", [])
-        print(f"已加载工具: {[t['name'] for t in self.tools]}")
+        raw_tools = response.get("result", {}).get("tools", [])
+
+        # ⭐ 工具列表初始化后不再变化：转成属性访问的小对象，名字 / 描述 / prompt 前缀只算一次
+        self.tools = [
+            SimpleNamespace(name=t["name"], description=t.get("description", ""))
+            for t in raw_tools
+        ]
+        self.tool_names = [t.name for t in self.tools]
+        self.tools_desc_str = "\n".join(
+            f"- {t.name}: {t.description or '无描述'}" for t in self.tools
+        )
+        print(f"已加载工具: {self.tool_names}")
 
-    async def _send_request(self, request: Dict) -> Dict:
-        self._request_id += 1
-        request_id = self._request_id
-        request["id"] = request_id
+        self._prompt_prefix = (
+            "\n你是一个智能助手，可以使用以下工具：\n"
+            + self.tools_desc_str
+            + "\n\n用户问题："
+        )
 
-        fut = asyncio.get_running_loop().create_future()
-        self._pending_requests[request_id] = fut
+    async def _send_request(self, request: Dict) -> Dict:
+        fut = self._loop.create_future()
+        request["id"] = self._acquire_slot(fut)
 
-        self.process.stdin.write((json.dumps(request) + "\n").encode())
-        await self.process.stdin.drain()
+        # ⭐ 只入队，由 _stdin_writer 合并写出
+        await self._out_queue.put(_dumps_line(request))
 
         return await fut
 
+    def _acquire_slot(self, fut: asyncio.Future) -> int:
+        if self._conn_error is not None:
+            raise self._conn_error
+
+        request_id = next(self._ids)
+
+        # ⭐ 槽位还被更早的请求占着：表不到半满就跳过这个 id（id 只需唯一，不必连续），
+        # 真的快满了才翻倍扩容，一个卡住的请求不会让数组无限变大
+        while self._slots[request_id & self._mask] is not None:
+            if 2 * self._pending >= len(self._slots):
+                self._grow_slots()
+            else:
+                request_id = next(self._ids)
+
+        self._slots[request_id & self._mask] = (request_id, fut)
+        self._pending += 1
+
+        # ⭐ 调用方被取消（例如 wait_for 超时）时归还槽位；正常收到响应时这里是空操作
+        fut.add_done_callback(lambda _, rid=request_id: self._release_slot(rid))
+        return request_id
+
+    def _grow_slots(self):
+        # ⭐ 按新掩码重新放置在途请求：原来不冲突的 id 低位不同，翻倍后依然不冲突
+        slots: List[Optional[tuple]] = [None] * (2 * len(self._slots))
+        mask = len(slots) - 1
+        for entry in self._slots:
+            if entry is not None:
+                slots[entry[0] & mask] = entry
+        self._slots, self._mask = slots, mask
+
+    def _release_slot(self, request_id: Any) -> Optional[asyncio.Future]:
+        # ⭐ 未知 / 非法 / 过期 id 返回 None（例如 server push event）
+        if type(request_id) is not int:
+            return None
+
+        slot = request_id & self._mask
+        entry = self._slots[slot]
+        if entry is None or entry[0] != request_id:
+            return None
+
+        self._slots[slot] = None
+        self._pending -= 1
+        return entry[1]
+
+    def _inflight(self) -> int:
+        return self._pending
+
     async def call_tool(self, tool_name: str, arguments: Dict):
-        request = {
-            "jsonrpc": "2.0",
-            "method": "tools/call",
-            "params": {"name": tool_name, "arguments": arguments},
-        }
+        fut = self._loop.create_future()
+        request_id = self._acquire_slot(fut)
 
-        response = await self._send_request(request)
+        await self._out_queue.put(_call_frame(request_id, tool_name, arguments))
+
+        response = await fut
 
         if "error" in response:
             raise Exception(response["error"])
@@ -148,23 +436,10 @@ class ManualMCPAgent:
     # LLM Chat
     # ==============================
     async def chat(self, user_message: str) -> str:
-        tools_desc = "\n".join(
-            [f"- {t['name']}: {t.get('description', '无描述')}" for t in self.tools]
-        )
-
-        prompt = f"""
-你是一个智能助手，可以使用以下工具：
-{tools_desc}
-
-用户问题：{user_message}
+        prompt = self._prompt_prefix + user_message + _PROMPT_SUFFIX
 
-如果需要使用工具，请返回JSON：
-{{"tool": "...", "args": {{}}}}
-否则直接回答。
-"""
-
-        # ⭐ 注意：真实生产这里应该用 async client
-        response = openai.chat.completions.create(
+        # ⭐ async client：等待 LLM 时 listener / heartbeat 照常运行
+        response = await self._oai.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": prompt}],
             temperature=0,
@@ -172,15 +447,19 @@ class ManualMCPAgent:
 
         llm_output = response.choices[0].message.content
 
-        try:
-            tool_call = json.loads(llm_output)
-            if "tool" in tool_call:
-                result = await self.call_tool(
-                    tool_call["tool"], tool_call.get("args", {})
-                )
-                return f"工具调用结果: {result}"
-        except Exception:
-            pass
+        # ⭐ 普通文本回复(大多数情况)不以 '{' 开头，直接跳过解析
+        tool_call = None
+        stripped = llm_output.lstrip()
+        if stripped[:1] == "{":
+            try:
+                tool_call, _ = _DECODER.raw_decode(stripped)
+            except ValueError:
+                pass
+
+        # ⭐ 只有解析失败才当普通文本；工具调用本身的错误（例如连接断开）照常抛出
+        if tool_call and "tool" in tool_call:
+            result = await self.call_tool(tool_call["tool"], tool_call.get("args", {}))
+            return f"工具调用结果: {result}"
 
         return llm_output
 
@@ -222,6 +501,14 @@ async def main_concurrent():
 
 if __name__ == "__main__":
 
+    # ⭐ 装了 uvloop 就用它：子进程管道读写和任务调度都走 libuv 快路径
+    try:
+        import uvloop
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     # 顺序
     asyncio.run(main())
 
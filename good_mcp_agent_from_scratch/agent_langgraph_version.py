@@ -1,24 +1,187 @@
 import asyncio
+import itertools
 import json
-from typing import Dict, List, TypedDict, Annotated, Literal
+import sys
+from types import SimpleNamespace
+from typing import Dict, List, Optional, TypedDict, Annotated, Literal
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 import openai
 
+try:
+    import orjson
+except ImportError:  # ⭐ 没装 orjson 时回退到标准库
+    orjson = None
 
-# ============ MCP Agent (完整版, 包含后台任务) ============
-class MCPAgent:
-    def __init__(self, server_module: str):
+try:
+    import ijson
+except ImportError:  # 可选: 只有超大单行响应才用得上
+    ijson = None
+
+
+def _loads(data: bytes):
+    """解析一行JSON (orjson 直接吃 bytes)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj) -> bytes:
+    """序列化为JSON bytes (orjson 直接吐 bytes)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def _dumps_line(obj) -> bytes:
+    """序列化为一行JSON bytes (换行由orjson在同一次分配里追加)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(obj).encode() + b"\n"
+
+
+# tools/call 信封固定部分预先编码, 每次只序列化 name / arguments / id
+_CALL_HEAD = b'{"jsonrpc":"2.0","method":"tools/call","params":{"name":'
+_CALL_ARGS = b',"arguments":'
+_CALL_ID = b'},"id":'
+
+
+def _call_frame(request_id: int, name: str, args: Dict) -> bytes:
+    """拼出一帧 tools/call 请求"""
+    return b"".join(
+        (
+            _CALL_HEAD,
+            _dumps(name),
+            _CALL_ARGS,
+            _dumps(args),
+            _CALL_ID,
+            str(request_id).encode(),
+            b"}\n",
+        )
+    )
+
+
+# LLM 输出解析器: raw_decode 一次扫描, 允许JSON后面跟说明文字
+_DECODER = json.JSONDecoder()
+
+# 出站批量写: 单批字节上限, 随in-flight请求数自适应增长
+_BATCH_MIN_BYTES = 64 * 1024
+_BATCH_MAX_BYTES = 1024 * 1024
+
+_READ_CHUNK = 64 * 1024  # stdout每次读取的块大小
+_STREAM_THRESHOLD = 256 * 1024  # 单行超过这个大小还没换行, 改成边收边解析 (需要ijson)
+_HEARTBEAT_INTERVAL = 5  # 心跳周期(秒)
+_METRICS_INTERVAL = 10  # 指标周期(秒)
+_SHUTDOWN_TIMEOUT = 1.0  # stop()等待后台任务退出的上限(秒)
+_INITIAL_SLOTS = 1024  # 请求槽位初始数量 (2的幂, 在途请求过半时翻倍)
+_MAX_STEPS = 25  # chat_fast最多走几轮llm (对齐LangGraph默认recursion_limit)
+
+# prompt固定后缀 (前缀依赖工具列表, 首次调用时拼一次)
+_PROMPT_SUFFIX = """
+
+如果需要使用工具，返回JSON格式:
+{"tool": "工具名", "args": {}}
+
+否则直接回答用户问题。
+"""
+
+
+class _LineStream:
+    """超大单行JSON: 数据一到就喂给ijson, 收到换行时解析已基本完成"""
+
+    def __init__(self):
+        self._items = ijson.sendable_list()
+        self._coro = ijson.items_coro(self._items, "", use_float=True)
+        self._error: Optional[Exception] = None
+
+    def feed(self, data: bytes):
+        if self._error is None:
+            try:
+                self._coro.send(data)
+            except Exception as e:
+                self._error = e
+
+    def finish(self):
+        if self._error is None:
+            try:
+                self._coro.close()
+            except Exception as e:
+                self._error = e
+        if self._error is not None:
+            raise self._error
+        return self._items[0]
+
+
+# ============ 共享连接 (一个server_module一个子进程, 包含后台任务) ============
+class _SharedConn:
+    """一个MCP Server子进程 + 后台任务, 被同一server_module的所有MCPAgent复用"""
+
+    # ping帧是常量, 预先编码好
+    _PING_FRAME = b'{"type":"ping"}\n'
+
+    # ⭐ 连接池: server_module -> 正在打开/已打开的连接
+    _POOL: Dict[str, "asyncio.Task[_SharedConn]"] = {}
+
+    def __init__(self, server_module: str, debug: bool = False):
         self.server_module = server_module
+        self._refs = 0  # 引用该连接的MCPAgent数量
         self.process = None
-        self.tools = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.tools: List[SimpleNamespace] = []
+        self.tool_names: List[str] = []
+        self.tools_desc_str = ""
         self._tasks = []  # ⭐ 后台任务列表
         self._running = False
-        self._pending_requests: Dict[int, asyncio.Future] = {}
-        self._request_id = 0
-
-    async def start(self):
-        """启动MCP Server连接"""
+        self._debug = debug  # 指标只在debug时输出到stderr
+        self._alive_ticks = 0
+        # ⭐ id单调递增 (会话内不复用), 槽位 = id & mask, 槽里存 (id, future)
+        self._ids = itertools.count(1)
+        self._slots: List[Optional[tuple]] = [None] * _INITIAL_SLOTS
+        self._mask = _INITIAL_SLOTS - 1
+        self._pending = 0
+        # ⭐ 连接断开的原因: 之后的请求直接抛出, 不再排队等永远不会来的响应
+        self._conn_error: Optional[BaseException] = None
+        self._out_queue: asyncio.Queue = asyncio.Queue()  # ⭐ 出站帧队列
+
+    @classmethod
+    async def acquire(cls, server_module: str, debug: bool = False) -> "_SharedConn":
+        """从连接池取连接, 没有就打开一个 (并发acquire只会打开一次)"""
+        task = cls._POOL.get(server_module)
+        if task is None:
+            task = asyncio.create_task(cls(server_module, debug)._open())
+            cls._POOL[server_module] = task
+        try:
+            conn = await asyncio.shield(task)
+        except BaseException:
+            if task.done() and cls._POOL.get(server_module) is task:
+                del cls._POOL[server_module]
+            raise
+        conn._debug = conn._debug or debug
+        conn._refs += 1
+        return conn
+
+    async def release(self):
+        """归还连接, 最后一个使用者归还时关闭子进程"""
+        self._refs -= 1
+        if self._refs == 0:
+            self._evict()
+            await self._close()
+
+    def _evict(self):
+        """移出连接池 (池里还是自己时才移), 之后的acquire会打开新的子进程"""
+        task = self._POOL.get(self.server_module)
+        if (
+            task is not None
+            and task.done()
+            and not task.cancelled()
+            and task.exception() is None
+            and task.result() is self
+        ):
+            del self._POOL[self.server_module]
+
+    async def _open(self) -> "_SharedConn":
+        """启动MCP Server子进程"""
+        self._loop = asyncio.get_running_loop()  # 缓存事件循环, 供热路径使用
         self.process = await asyncio.create_subprocess_exec(
             "python",
             "-m",
@@ -28,93 +191,261 @@ class MCPAgent:
             stderr=asyncio.subprocess.PIPE,
         )
 
-        self._running = True
+        # ⭐ 初始化失败时池里不会留下这个连接, 子进程和后台任务必须在这里收掉
+        try:
+            self._running = True
 
-        # ⭐ 启动3个后台任务 (必须!)
-        self._tasks.append(asyncio.create_task(self._stdout_listener()))
-        self._tasks.append(asyncio.create_task(self._heartbeat()))
-        self._tasks.append(asyncio.create_task(self._metrics_pusher()))
+            # ⭐ 启动后台任务 (必须!)
+            self._tasks.append(asyncio.create_task(self._stdin_writer()))
+            self._tasks.append(asyncio.create_task(self._stdout_listener()))
+            self._tasks.append(asyncio.create_task(self._periodic()))
 
-        # 初始化获取工具列表
-        await self._initialize()
+            # 初始化获取工具列表
+            await self._initialize()
+        except BaseException:
+            await self._close()
+            raise
+        return self
 
-    async def stop(self):
+    async def _close(self):
         """清理"""
         self._running = False
         for task in self._tasks:
             task.cancel()
-        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # ⭐ 带deadline等待, 防止某个任务吞掉CancelledError导致卡死
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=_SHUTDOWN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending, timeout=0.1)
+            self._tasks.clear()
         if self.process:
-            self.process.kill()
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass  # 子进程已经退出 (例如初始化失败)
             await self.process.wait()
 
+    async def _stdin_writer(self):
+        """合并同一轮事件循环里排队的帧, 一次write + drain"""
+        while self._running:
+            try:
+                first = await self._out_queue.get()
+                buf = bytearray(first)
+                cap = min(
+                    _BATCH_MAX_BYTES,
+                    _BATCH_MIN_BYTES * (1 + self._inflight() // 16),
+                )
+                while not self._out_queue.empty() and len(buf) < cap:
+                    buf += self._out_queue.get_nowait()
+                self.process.stdin.write(buf)
+                await self.process.stdin.drain()
+            except asyncio.CancelledError:
+                break
+            except (ConnectionResetError, BrokenPipeError) as e:
+                # ⭐ server已经退出: 在途请求都等不到响应了, 全部失败并停止写
+                print(f"stdin writer error: {e}")
+                self._fail_pending(e)
+                break
+            except Exception as e:
+                print(f"stdin writer error: {e}")
+
+    def _fail_pending(self, exc: BaseException):
+        """连接断开: 让所有在途请求抛出exc, 丢弃还没写出的帧, 不再把这个连接分给新Agent"""
+        self._conn_error = exc
+        self._evict()
+        for entry in self._slots:
+            if entry is not None and not entry[1].done():
+                entry[1].set_exception(exc)
+        self._slots = [None] * len(self._slots)
+        self._pending = 0
+        while not self._out_queue.empty():
+            self._out_queue.get_nowait()
+
     # ⭐ 核心: stdout监听器 (必须!)
     async def _stdout_listener(self):
         """持续读取MCP Server输出"""
+        buf = bytearray()  # ⭐ 复用的行缓冲, 用户态按\n切行
+        stream: Optional[_LineStream] = None  # 正在流式解析的超大响应
         while self._running:
             try:
-                line = await self.process.stdout.readline()
-                if not line:
+                chunk = await self.process.stdout.read(_READ_CHUNK)
+                if not chunk:
+                    # ⭐ server退出: 已经写出去的请求也等不到响应了
+                    self._fail_pending(ConnectionResetError("MCP server closed stdout"))
                     break
-
-                msg = json.loads(line.decode())
-
-                # 处理response
-                if "id" in msg and msg["id"] in self._pending_requests:
-                    fut = self._pending_requests.pop(msg["id"])
-                    if not fut.done():
-                        fut.set_result(msg)
-
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 print(f"stdout listener error: {e}")
-
-    async def _heartbeat(self):
-        """心跳"""
-        while self._running:
-            try:
-                if self.process:
-                    ping = {"type": "ping"}
-                    self.process.stdin.write(json.dumps(ping).encode() + b"\n")
-                    await self.process.stdin.drain()
-            except Exception as e:
-                print(f"heartbeat error: {e}")
-            await asyncio.sleep(5)
-
-    async def _metrics_pusher(self):
-        """指标"""
+                continue
+
+            if stream is not None:
+                nl = chunk.find(b"\n")
+                if nl == -1:
+                    stream.feed(chunk)
+                    continue
+                stream.feed(chunk[:nl])
+                try:
+                    self._dispatch(stream.finish())
+                except Exception as e:
+                    print(f"stdout listener error: {e}")
+                stream = None
+                chunk = chunk[nl + 1 :]
+
+            buf += chunk
+            while (nl := buf.find(b"\n")) != -1:
+                line = bytes(buf[:nl])
+                del buf[: nl + 1]
+                try:
+                    self._dispatch(_loads(line))
+                except Exception as e:
+                    print(f"stdout listener error: {e}")
+
+            # ⭐ 迟迟等不到换行: 改成边收边解析
+            if ijson is not None and len(buf) > _STREAM_THRESHOLD:
+                stream = _LineStream()
+                stream.feed(buf)
+                buf.clear()
+
+    def _dispatch(self, msg: Dict):
+        """处理response"""
+        rid = msg.get("id")
+        fut = self._release_slot(rid) if rid is not None else None
+        if fut is not None:
+            if not fut.done():
+                fut.set_result(msg)
+
+    async def _periodic(self):
+        """心跳 + 指标 (合并成一个定时循环)"""
+        loop = asyncio.get_running_loop()
+        next_hb = next_mx = loop.time()
         while self._running:
-            try:
-                print(f"[Metrics] Agent alive, tools: {len(self.tools)}")
-            except Exception as e:
-                print(f"metrics error: {e}")
-            await asyncio.sleep(10)
+            now = loop.time()
+            if now >= next_hb:
+                try:
+                    self._write_ping_nowait()
+                except Exception as e:
+                    print(f"heartbeat error: {e}")
+                next_hb = now + _HEARTBEAT_INTERVAL
+            if now >= next_mx:
+                self._alive_ticks += 1
+                if self._debug:
+                    sys.stderr.write(
+                        f"[Metrics] Agent alive {self._alive_ticks}, tools: {len(self.tools)}\n"
+                    )
+                next_mx = now + _METRICS_INTERVAL
+            await asyncio.sleep(min(next_hb, next_mx) - now)
+
+    def _write_ping_nowait(self):
+        """心跳ping: 丢了无所谓, 直接写transport, 不排队也不走drain流控"""
+        if self.process:
+            transport = self.process.stdin.transport
+            if not transport.is_closing():
+                transport.write(self._PING_FRAME)
 
     async def _initialize(self):
         request = {"jsonrpc": "2.0", "method": "tools/list"}
-        response = await self._send_request(request)
-        self.tools = response.get("result", {}).get("tools", [])
-
-    async def _send_request(self, request: Dict) -> Dict:
-        self._request_id += 1
-        request["id"] = self._request_id
+        response = await self.send(request)
+        raw_tools = response.get("result", {}).get("tools", [])
+
+        # ⭐ 工具列表不再变化: 属性访问的小对象, 名字和描述串只算一次
+        self.tools = [
+            SimpleNamespace(name=t["name"], description=t.get("description", ""))
+            for t in raw_tools
+        ]
+        self.tool_names = [t.name for t in self.tools]
+        self.tools_desc_str = "\n".join(
+            f"- {t.name}: {t.description}" for t in self.tools
+        )
 
-        fut = asyncio.get_running_loop().create_future()
-        self._pending_requests[request["id"]] = fut
+    async def send(self, request: Dict) -> Dict:
+        fut = self._loop.create_future()
+        request["id"] = self._acquire_slot(fut)
 
-        self.process.stdin.write(json.dumps(request).encode() + b"\n")
-        await self.process.stdin.drain()
+        await self._out_queue.put(_dumps_line(request))  # 由_stdin_writer批量写出
 
         return await fut  # ⭐ 由_stdout_listener填充结果
 
+    def _acquire_slot(self, fut: asyncio.Future) -> int:
+        """分配新的请求id并把Future放进它的槽位, 槽位被占时翻倍扩容"""
+        if self._conn_error is not None:
+            raise self._conn_error
+        request_id = next(self._ids)
+        # ⭐ 槽位被占: 表不到半满就跳过这个id (id只需唯一), 快满了才翻倍扩容
+        while self._slots[request_id & self._mask] is not None:
+            if 2 * self._pending >= len(self._slots):
+                self._grow_slots()
+            else:
+                request_id = next(self._ids)
+        self._slots[request_id & self._mask] = (request_id, fut)
+        self._pending += 1
+        # ⭐ 调用方被取消时归还槽位 (正常收到响应时是空操作)
+        fut.add_done_callback(lambda _, rid=request_id: self._release_slot(rid))
+        return request_id
+
+    def _grow_slots(self):
+        """翻倍并按新掩码重新放置在途请求 (原来不冲突的id翻倍后依然不冲突)"""
+        slots: List[Optional[tuple]] = [None] * (2 * len(self._slots))
+        mask = len(slots) - 1
+        for entry in self._slots:
+            if entry is not None:
+                slots[entry[0] & mask] = entry
+        self._slots, self._mask = slots, mask
+
+    def _release_slot(self, request_id) -> Optional[asyncio.Future]:
+        """按id取回Future并归还槽位, 未知/过期id返回None"""
+        if type(request_id) is not int:
+            return None
+        slot = request_id & self._mask
+        entry = self._slots[slot]
+        if entry is None or entry[0] != request_id:
+            return None
+        self._slots[slot] = None
+        self._pending -= 1
+        return entry[1]
+
+    def _inflight(self) -> int:
+        return self._pending
+
     async def call_tool(self, name: str, args: Dict) -> Dict:
-        request = {
-            "jsonrpc": "2.0",
-            "method": "tools/call",
-            "params": {"name": name, "arguments": args},
-        }
-        response = await self._send_request(request)
+        fut = self._loop.create_future()
+        request_id = self._acquire_slot(fut)
+        await self._out_queue.put(_call_frame(request_id, name, args))
+        return await fut
+
+
+# ============ MCP Agent ============
+class MCPAgent:
+    """逻辑Agent: 同一个server_module的多个实例共享一个子进程和一组后台任务"""
+
+    def __init__(self, server_module: str, debug: bool = False):
+        self.server_module = server_module
+        self._debug = debug
+        self._conn: Optional[_SharedConn] = None
+        self.tools: List[SimpleNamespace] = []
+        self.tool_names: List[str] = []
+        self.tools_desc_str = ""
+
+    async def start(self):
+        """启动MCP Server连接 (从连接池复用)"""
+        self._conn = await _SharedConn.acquire(self.server_module, self._debug)
+        self.tools = self._conn.tools
+        self.tool_names = self._conn.tool_names
+        self.tools_desc_str = self._conn.tools_desc_str
+
+    async def stop(self):
+        """清理 (最后一个Agent stop时才真正关闭子进程)"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            await conn.release()
+
+    async def _send_request(self, request: Dict) -> Dict:
+        return await self._conn.send(request)
+
+    async def call_tool(self, name: str, args: Dict) -> Dict:
+        response = await self._conn.call_tool(name, args)
         return response.get("result")
 
 
@@ -130,6 +461,8 @@ class AgentState(TypedDict):
 class LangGraphMCPAgent:
     def __init__(self, mcp_agent: MCPAgent):
         self.mcp = mcp_agent
+        self._oai = openai.AsyncOpenAI()  # ⭐ 异步client, 不阻塞事件循环
+        self._prompt_prefix = None
         self._setup_graph()
 
     def _setup_graph(self):
@@ -148,26 +481,23 @@ class LangGraphMCPAgent:
 
         self.graph = workflow.compile()
 
+    def _get_prompt_prefix(self) -> str:
+        """工具列表在MCP初始化后不再变化, prompt前缀只拼一次"""
+        if self._prompt_prefix is None:
+            self._prompt_prefix = (
+                "你是一个智能助手，可以使用以下工具:\n"
+                + self.mcp.tools_desc_str
+                + "\n\n用户问题: "
+            )
+        return self._prompt_prefix
+
     async def call_llm(self, state: AgentState) -> AgentState:
         """调用LLM决定使用哪个工具"""
-        tools_desc = "\n".join(
-            [f"- {t['name']}: {t.get('description', '')}" for t in self.mcp.tools]
-        )
-
         last_message = state["messages"][-1]["content"]
 
-        prompt = f"""你是一个智能助手，可以使用以下工具:
-{tools_desc}
+        prompt = self._get_prompt_prefix() + last_message + _PROMPT_SUFFIX
 
-用户问题: {last_message}
-
-如果需要使用工具，返回JSON格式:
-{{"tool": "工具名", "args": {{}}}}
-
-否则直接回答用户问题。
-"""
-
-        response = openai.chat.completions.create(
+        response = await self._oai.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": prompt}],
             temperature=0,
@@ -175,15 +505,19 @@ class LangGraphMCPAgent:
 
         llm_output = response.choices[0].message.content
 
-        try:
-            tool_call = json.loads(llm_output)
-            if "tool" in tool_call:
-                state["tool_calls"] = [tool_call]
-                state["next"] = "continue"
-            else:
-                state["messages"].append({"role": "assistant", "content": llm_output})
-                state["next"] = "end"
-        except:
+        # 普通文本回复不以 '{' 开头, 不进入解析器
+        tool_call = None
+        stripped = llm_output.lstrip()
+        if stripped[:1] == "{":
+            try:
+                tool_call, _ = _DECODER.raw_decode(stripped)
+            except ValueError:
+                pass
+
+        if tool_call and "tool" in tool_call:
+            state["tool_calls"] = [tool_call]
+            state["next"] = "continue"
+        else:
             state["messages"].append({"role": "assistant", "content": llm_output})
             state["next"] = "end"
 
@@ -191,15 +525,21 @@ class LangGraphMCPAgent:
 
     async def execute_tools(self, state: AgentState) -> AgentState:
         """执行MCP工具调用"""
-        results = []
-        for tool_call in state.get("tool_calls", []):
-            try:
-                result = await self.mcp.call_tool(
-                    tool_call["tool"], tool_call.get("args", {})
-                )
-                results.append({"tool": tool_call["tool"], "result": result})
-            except Exception as e:
-                results.append({"tool": tool_call["tool"], "error": str(e)})
+        tool_calls = state.get("tool_calls", [])
+
+        # ⭐ 多个工具调用并发发出, 共用一次批量写 + 一个RTT
+        raw = await asyncio.gather(
+            *(self.mcp.call_tool(tc["tool"], tc.get("args", {})) for tc in tool_calls),
+            return_exceptions=True,
+        )
+        results = [
+            (
+                {"tool": tc["tool"], "error": str(r)}
+                if isinstance(r, Exception)
+                else {"tool": tc["tool"], "result": r}
+            )
+            for tc, r in zip(tool_calls, raw)
+        ]
 
         state["tool_results"] = results
         for r in results:
@@ -227,8 +567,31 @@ class LangGraphMCPAgent:
         }
 
         final_state = await self.graph.ainvoke(initial_state)
+        return self._final_answer(final_state)
+
+    async def chat_fast(self, message: str) -> str:
+        """热路径: 不经过StateGraph, 原地跑 llm -> execute_tools -> llm ... 的线性状态机
+
+        复用同一个state字典, 没有每条边的状态拷贝和图调度开销。
+        编译好的graph仍保留, 调试时用chat()。
+        """
+        state = {
+            "messages": [{"role": "user", "content": message}],
+            "tool_calls": [],
+            "tool_results": [],
+            "next": "",
+        }
+
+        for _ in range(_MAX_STEPS):
+            await self.call_llm(state)
+            if self.should_continue(state) == "end":
+                break
+            await self.execute_tools(state)
+
+        return self._final_answer(state)
 
-        for msg in reversed(final_state["messages"]):
+    def _final_answer(self, state: AgentState) -> str:
+        for msg in reversed(state["messages"]):
             if msg["role"] == "assistant":
                 return msg["content"]
 
@@ -237,10 +600,10 @@ class LangGraphMCPAgent:
 
 # ============ 主程序 ============
 async def main():
-    # 1. 启动MCP Agent (包含3个后台任务)
+    # 1. 启动MCP Agent (包含后台任务)
     mcp = MCPAgent("mcp-server-weather")
     await mcp.start()
-    print(f"可用工具: {[t['name'] for t in mcp.tools]}")
+    print(f"可用工具: {mcp.tool_names}")
 
     try:
         # 2. 创建LangGraph Agent
@@ -261,4 +624,12 @@ async def main():
 
 
 if __name__ == "__main__":
+    # 装了uvloop就用它 (管道IO和任务调度更快)
+    try:
+        import uvloop
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     asyncio.run(main())
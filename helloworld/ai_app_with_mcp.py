@@ -1,509 +1,886 @@
 """
 AI App with Multiple MCP Servers - Complete Example
-Demonstrates how an AI application handles multiple MCP servers with callbacks
+Demonstrates how an AI application handles multiple MCP servers on one asyncio event loop
 """
 
-import subprocess
+import asyncio
+import itertools
 import json
-import threading
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import re
+import struct
+import sys
 import time
-from typing import Dict, Callable, Optional
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import queue
 import random
 
+try:
+    import orjson  # SIMD JSON parser; parses bytes directly
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+log = logging.getLogger(__name__)
+
+
+def start_logging(level: int = logging.WARNING) -> logging.handlers.QueueListener:
+    """
+    Route log records through an in-memory queue.
+    Callers on the event loop only enqueue; one listener thread formats and
+    writes to stderr. At WARNING the per-request debug chatter is dropped.
+    """
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(
+        records, logging.StreamHandler(sys.stderr)
+    )
+    listener.start()
+    return listener
+
+
+def _json_loads(data: bytes):
+    """Parse a JSON document from bytes, preferring orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    """Serialize to JSON bytes, preferring orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def _extract_text(result: dict) -> str:
+    """Text of the first content item; no default list/dict built on the happy path"""
+    try:
+        return result["content"][0]["text"]
+    except (KeyError, IndexError, TypeError):
+        return "No data"
+
+
+# LSP-style framing used by the servers: "Content-Length: N\r\n\r\n" + N bytes of JSON
+CONTENT_LENGTH = b"Content-Length:"
+
+# Compact binary responses, enabled per server by a "register" notification:
+#   16-byte header (magic, request ID, payload length) + UTF-8 result text,
+#   or + UTF-8 error message under ERROR_MAGIC
+RECORD_MAGIC = b"MCP1"
+ERROR_MAGIC = b"MCPE"
+RECORD_HEADER = struct.Struct("<4sIQ")
+REGISTER_FRAME = b'{"jsonrpc":"2.0","method":"register"}\n'
+
+# In-flight request ring: slot = request ID & mask (power of two). IDs are
+# monotonic, so a slot still occupied when its next ID comes round means
+# more than PENDING_CAPACITY requests are in flight
+PENDING_CAPACITY = 4096
+PENDING_MASK = PENDING_CAPACITY - 1
+
+# Requests queued within this window are sent to a server as one JSON-RPC batch
+BATCH_WINDOW = 0.001
+
+# Batches go out with one gathered os.writev (POSIX only) when they fit in
+# IOV_MAX buffers (1024 on Linux and macOS)
+HAS_WRITEV = hasattr(os, "writev")
+IOV_MAX = 1024
+
+# Kernel pipe buffer size for server stdio (Linux F_SETPIPE_SZ; skipped elsewhere):
+# a whole burst of responses fits without the server blocking on flush
+PIPE_SIZE = 1 << 20
+
+
+def _pipe_file(conn, mode: str, buffering: int = -1):
+    """Take over one end of a multiprocessing Pipe as a plain binary file"""
+    fd = os.dup(conn.fileno())
+    conn.close()
+    if fcntl is not None and hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, PIPE_SIZE)
+        except OSError:
+            pass  # Above /proc/sys/fs/pipe-max-size: keep the default
+    return os.fdopen(fd, mode, buffering=buffering)
+
+
+# Question routing table:
+#   route name -> (subject keywords,
+#                  (server, tool, arguments, UI label, ((needle in result, suggestion), ...)))
+# Server and tool names are identifier-like literals, so the compiler interns
+# them; no name is ever taken from parsed JSON, so every dict lookup keyed on
+# them (mcp_servers, pending server, _REQUEST_TEMPLATES) hits the identity fast path
+ROUTES = {
+    "beijing": (
+        ("beijing", "北京"),
+        (
+            "weather",
+            "get_weather",
+            {"city": "Beijing"},
+            "Beijing",
+            (("sunny", "It's sunny in Beijing! Good day for outdoor activities."),),
+        ),
+    ),
+    "shanghai": (
+        ("shanghai", "上海"),
+        ("weather", "get_weather", {"city": "Shanghai"}, "Shanghai", ()),
+    ),
+    "apple": (
+        ("apple", "苹果"),
+        (
+            "stock",
+            "get_stock_price",
+            {"symbol": "AAPL"},
+            "AAPL",
+            (("182", "AAPL at good price, consider buying"),),
+        ),
+    ),
+    "tesla": (
+        ("tesla", "特斯拉"),
+        (
+            "stock",
+            "get_stock_price",
+            {"symbol": "TSLA"},
+            "TSLA",
+            (("175", "TSLA price low, maybe wait"),),
+        ),
+    ),
+}
+
+# All route keywords compiled into one case-insensitive alternation, one named
+# group per route: a single C-level scan, no lowercase copy of the question
+_ROUTER_RE = re.compile(
+    "|".join(
+        f"(?P<{name}>{'|'.join(map(re.escape, keywords))})"
+        for name, (keywords, _) in ROUTES.items()
+    ),
+    re.IGNORECASE,
+)
+
+# Pre-serialized JSON-RPC envelope per (server, tool): only the request ID and
+# the arguments are formatted in per call, the invariant parts are never rebuilt
+_REQUEST_TEMPLATES = {
+    (server, tool): b'{"jsonrpc":"2.0","id":%d,"method":"tools/call","params":{"name":'
+    + _json_dumps(tool)
+    + b',"arguments":%b}}'
+    for _, (server, tool, *_) in ROUTES.values()
+}
+
+
+def _request_frame(
+    server_name: str, tool_name: str, request_id: int, arguments: dict
+) -> bytes:
+    """Serialized tools/call request, from its template when one exists"""
+    template = _REQUEST_TEMPLATES.get((server_name, tool_name))
+    if template is None:
+        return _json_dumps(
+            {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": "tools/call",
+                "params": {"name": tool_name, "arguments": arguments},
+            }
+        )
+    return template % (request_id, _json_dumps(arguments))
+
 
 class MyAIAgent:
     """
     AI Agent that manages multiple MCP servers and handles concurrent responses
     Key concepts demonstrated:
     1. Each MCP server runs in its own subprocess with independent pipes
-    2. Callbacks are stored as Python function objects (not JSON/code)
-    3. Listener threads run in background to monitor server responses
-    4. Main thread remains responsive for user interaction
-    5. Thread locking protects shared data structures
+    2. Pending requests are asyncio.Future objects in a ring indexed by request ID
+    3. One listener task per server runs on the event loop (no extra threads)
+    4. Main coroutine stays responsive while requests are in flight
+    5. Single-threaded event loop means no locks around shared data
     """
 
     def __init__(self):
-        # Store MCP server subprocesses
-        self.mcp_servers: Dict[str, subprocess.Popen] = {}
+        # Store MCP server processes
+        self.mcp_servers: Dict[str, multiprocessing.Process] = {}
+
+        # Pending requests: slot -> (request_id, server name, future, created_at ns)
+        self._pending: List[Optional[tuple]] = [None] * PENDING_CAPACITY
+        self.pending_count = 0
+
+        # Generator of unique request IDs (next() is a single C call)
+        self._id_gen = itertools.count(1)
 
-        # Track pending requests: request_id -> {"server": name, "callback": func}
-        self.pending_requests: Dict[int, dict] = {}
+        # Listener tasks, one per server
+        self._listeners: Dict[str, asyncio.Task] = {}
 
-        # Counter for unique request IDs
-        self.request_counter = 1
+        # Binary stdin writer of each server, cached for the flush hot path
+        self._stdin_writers: Dict[str, asyncio.StreamWriter] = {}
+        self._stdin_fds: Dict[str, int] = {}
 
-        # Lock for thread-safe access to shared data
-        self.lock = threading.Lock()
+        # Serialized requests waiting for the next batch flush, per server
+        # (request ID, frame) pairs, so a failed batch can fail its own requests
+        self._outbox: Dict[str, List[Tuple[int, bytes]]] = defaultdict(list)
+        self._flush_task: Optional[asyncio.Task] = None
 
-        # Results queue for UI updates
-        self.results_queue = []
+        # Monotonic timestamp (ns) of the open batch window, shared by its requests
+        self._batch_ns = 0
+
+        # Worker threads for result handling, so a slow handler never stalls the loop
+        self._exec = ThreadPoolExecutor(max_workers=8, thread_name_prefix="cb")
+
+        # Results queue for UI updates (thread-safe appends, bounded memory)
+        self.results_queue = deque(maxlen=1024)
 
         print("🤖 AI Agent initialized")
 
-    def start_mcp_servers(self):
+    async def start_mcp_servers(self):
         """
-        Start multiple MCP servers as independent subprocesses.
-        Each server gets its own set of stdin/stdout/stderr pipes.
+        Start multiple MCP servers as independent processes.
+        Each server gets its own pair of stdin/stdout pipes.
         """
         print("🚀 Starting MCP servers...")
 
-        # Start Weather MCP Server
-        weather_proc = subprocess.Popen(
-            ["python", "weather_mcp.py"],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-        )
-        self.mcp_servers["weather"] = weather_proc
-
-        # Start Stock MCP Server
-        stock_proc = subprocess.Popen(
-            ["python", "stock_mcp.py"],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
+        # 🔑 Forked from a warm forkserver that has already imported this module:
+        # no fresh interpreter startup per server, no server script on disk
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["__main__"])
+        loop = asyncio.get_running_loop()
+
+        launches = []
+        for server_name, target in SERVERS:
+            child_stdin, parent_stdin = ctx.Pipe(duplex=False)
+            parent_stdout, child_stdout = ctx.Pipe(duplex=False)
+            child_ends = (child_stdin, child_stdout)
+            parent_ends = (parent_stdin, parent_stdout)
+            proc = ctx.Process(
+                target=target,
+                args=child_ends,
+                name=f"{server_name}-mcp",
+                daemon=True,
+            )
+            launches.append((server_name, proc, child_ends, parent_ends))
+
+        # Process.start() blocks (the first call boots the forkserver): run the
+        # launches on worker threads so they overlap and the loop stays free
+        await asyncio.gather(
+            *(asyncio.to_thread(proc.start) for _, proc, *_ in launches)
         )
-        self.mcp_servers["stock"] = stock_proc
-
-        # Start a listener thread for each server
-        for server_name, proc in self.mcp_servers.items():
-            listener_thread = threading.Thread(
-                target=self._listen_to_server,
-                args=(server_name, proc),
-                daemon=True,  # Thread exits when main program exits
+
+        for server_name, proc, child_ends, (parent_stdin, parent_stdout) in launches:
+            # The child owns its ends now
+            for conn in child_ends:
+                conn.close()
+            self.mcp_servers[server_name] = proc
+
+            # Wrap our ends as asyncio streams on the event loop
+            reader = asyncio.StreamReader()
+            await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader),
+                _pipe_file(parent_stdout, "rb", buffering=0),
             )
-            listener_thread.start()
-            print(f"   👂 Listener started for {server_name} server")
+            stdin_pipe = _pipe_file(parent_stdin, "wb", buffering=0)
+            transport, protocol = await loop.connect_write_pipe(
+                asyncio.streams.FlowControlMixin, stdin_pipe
+            )
+            writer = asyncio.StreamWriter(transport, protocol, None, loop)
+            self._stdin_writers[server_name] = writer
+            self._stdin_fds[server_name] = stdin_pipe.fileno()
+
+            # Switch the server to binary records before any request is queued
+            writer.write(REGISTER_FRAME)
+
+            # Start a listener task for the server
+            self._listeners[server_name] = asyncio.create_task(
+                self._listen(server_name, reader)
+            )
+            print(f"   👂 Listener started for {server_name} server (PID: {proc.pid})")
 
         print("✅ All MCP servers started")
 
-    def ask_question(self, question: str):
+    async def ask_question(self, question: str):
         """
         Main entry point for user questions.
-        Runs in the main thread and returns immediately (non-blocking).
+        Runs as a coroutine; schedule it with asyncio.create_task to keep going.
         """
         print(f"\n👤 User: {question}")
 
-        # Simple question routing
-        if "weather" in question.lower() or "天气" in question:
-            if "beijing" in question.lower() or "北京" in question:
-                self._get_beijing_weather()
-            elif "shanghai" in question.lower() or "上海" in question:
-                self._get_shanghai_weather()
-        elif "stock" in question.lower() or "股价" in question:
-            if "apple" in question.lower() or "苹果" in question:
-                self._get_apple_stock()
-            elif "tesla" in question.lower() or "特斯拉" in question:
-                self._get_tesla_stock()
-        else:
+        # Table-driven routing: the matching group's name is the route
+        match = _ROUTER_RE.search(question)
+        if match is None:
             print("❌ I don't understand that question")
-
-    # ========== CALLBACK DEFINITIONS (created in main thread) ==========
-
-    def _get_beijing_weather(self):
-        """Example: Get Beijing weather with callback"""
-        print("📡 Querying Beijing weather...")
-
-        # 🔑 Callback is defined HERE in main thread as a Python function object
-        def handle_beijing_weather(result: dict):
-            """This callback will execute later in listener thread"""
-            weather_text = result.get("content", [{}])[0].get("text", "No data")
-            print(f"✅ Beijing weather callback executed: {weather_text}")
-
-            # Update UI (in real app, this would trigger UI update)
-            self._update_ui(f"Beijing: {weather_text}")
-
-            # Can trigger further actions
-            if "sunny" in weather_text.lower():
-                self._suggest_action(
-                    "It's sunny in Beijing! Good day for outdoor activities."
-                )
-
-        # Make the MCP call with callback
-        self._call_mcp_tool(
-            server_name="weather",
-            tool_name="get_weather",
-            arguments={"city": "Beijing"},
-            callback=handle_beijing_weather,  # 🔑 Passing function object, not code
-        )
-
-    def _get_shanghai_weather(self):
-        """Example: Get Shanghai weather with callback"""
-        print("📡 Querying Shanghai weather...")
-
-        def handle_shanghai_weather(result: dict):
-            weather_text = result.get("content", [{}])[0].get("text", "No data")
-            print(f"✅ Shanghai weather callback executed: {weather_text}")
-            self._update_ui(f"Shanghai: {weather_text}")
-
-        self._call_mcp_tool(
-            server_name="weather",
-            tool_name="get_weather",
-            arguments={"city": "Shanghai"},
-            callback=handle_shanghai_weather,
-        )
-
-    def _get_apple_stock(self):
-        """Example: Get Apple stock price with callback"""
-        print("📈 Querying Apple stock...")
-
-        def handle_apple_stock(result: dict):
-            stock_text = result.get("content", [{}])[0].get("text", "No data")
-            print(f"✅ Apple stock callback executed: {stock_text}")
-            self._update_ui(f"AAPL: {stock_text}")
-
-            # Example: Make decision based on price
-            if "182" in stock_text:
-                self._suggest_action("AAPL at good price, consider buying")
-
-        self._call_mcp_tool(
-            server_name="stock",
-            tool_name="get_stock_price",
-            arguments={"symbol": "AAPL"},
-            callback=handle_apple_stock,
+            return
+
+        await self._run_query(*ROUTES[match.lastgroup][1])
+
+    # ========== QUERY HANDLER (one handler, parameterized by the route table) ==========
+
+    async def _run_query(
+        self,
+        server_name: str,
+        tool_name: str,
+        arguments: dict,
+        label: str,
+        triggers: tuple,
+    ):
+        """Query one tool, show the result, and suggest actions whose needle matches"""
+        print(f"📡 Querying {label}...")
+
+        # 🔑 Suspends this coroutine only; the event loop keeps serving others
+        result = await self._call_mcp_tool(server_name, tool_name, arguments)
+        if result is None:
+            return
+
+        # ⚠️ Handling may be slow (UI, follow-up actions): run it on a worker thread
+        # so listeners keep resolving other responses meanwhile
+        await asyncio.get_running_loop().run_in_executor(
+            self._exec, self._handle_result, label, triggers, result
         )
 
-    def _get_tesla_stock(self):
-        """Example: Get Tesla stock price with callback"""
-        print("📈 Querying Tesla stock...")
+    def _handle_result(self, label: str, triggers: tuple, result: dict):
+        """Show one query result and suggest actions. Runs in the worker pool."""
+        text = _extract_text(result)
+        print(f"✅ {label} result: {text}")
 
-        def handle_tesla_stock(result: dict):
-            stock_text = result.get("content", [{}])[0].get("text", "No data")
-            print(f"✅ Tesla stock callback executed: {stock_text}")
-            self._update_ui(f"TSLA: {stock_text}")
+        # Update UI (in real app, this would trigger UI update)
+        self._update_ui(f"{label}: {text}")
 
-            if "175" in stock_text:
-                self._suggest_action("TSLA price low, maybe wait")
-
-        self._call_mcp_tool(
-            server_name="stock",
-            tool_name="get_stock_price",
-            arguments={"symbol": "TSLA"},
-            callback=handle_tesla_stock,
-        )
+        # Can trigger further actions
+        lowered = text.lower()
+        for needle, suggestion in triggers:
+            if needle in lowered:
+                self._suggest_action(suggestion)
 
     # ========== CORE COMMUNICATION LOGIC ==========
 
-    def _call_mcp_tool(
-        self, server_name: str, tool_name: str, arguments: dict, callback: Callable
-    ) -> Optional[int]:
+    async def _call_mcp_tool(
+        self, server_name: str, tool_name: str, arguments: dict
+    ) -> Optional[dict]:
         """
-        Call an MCP tool (NON-BLOCKING).
+        Call an MCP tool and wait for its result.
 
         Args:
             server_name: Which MCP server to use
             tool_name: Tool to call
             arguments: Arguments for the tool
-            callback: Python function to execute when response arrives
 
         Returns:
-            Request ID or None if failed
+            The JSON-RPC "result" object, or None if the server is unknown
         """
         if server_name not in self.mcp_servers:
-            print(f"❌ Server '{server_name}' not found")
+            log.error("❌ Server '%s' not found", server_name)
             return None
 
-        # Generate unique request ID with thread protection
-        with self.lock:
-            request_id = self.request_counter
-            self.request_counter += 1
+        # Single-threaded event loop: no lock needed
+        request_id = next(self._id_gen)
+        slot = request_id & PENDING_MASK
+        if self._pending[slot] is not None:
+            log.error("❌ More than %d requests in flight", PENDING_CAPACITY)
+            return None
 
-            # 🔑 Store callback as Python function object in dictionary
-            self.pending_requests[request_id] = {
-                "server": server_name,
-                "callback": callback,  # This is the function object
-                "created_at": time.time(),
-            }
+        # The first request of a batch window opens it and reads the clock once;
+        # the rest of the batch reuses that timestamp
+        if self._flush_task is None:
+            self._batch_ns = time.monotonic_ns()
+            self._flush_task = asyncio.create_task(self._flusher())
 
-        # Prepare JSON-RPC request
-        request = {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "method": "tools/call",
-            "params": {"name": tool_name, "arguments": arguments},
-        }
+        # 🔑 The future is resolved by the listener task when the response arrives
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[slot] = (request_id, server_name, fut, self._batch_ns)
+        self.pending_count += 1
 
-        # Send to MCP server via its stdin pipe
-        proc = self.mcp_servers[server_name]
-        proc.stdin.write(json.dumps(request) + "\n")
-        proc.stdin.flush()
+        # Prepare JSON-RPC request (template fill, only id and arguments serialized)
+        request = _request_frame(server_name, tool_name, request_id, arguments)
 
-        print(f"📤 Sent request to {server_name} (ID: {request_id})")
-        return request_id
+        # 🔑 Queue it; the flusher sends everything queued in the window as one batch
+        self._outbox[server_name].append((request_id, request))
 
-    def _listen_to_server(self, server_name: str, proc: subprocess.Popen):
+        log.debug("📤 Queued request to %s (ID: %d)", server_name, request_id)
+        try:
+            return await fut
+        finally:
+            # A cancelled caller (e.g. a timeout) still owns its slot: give it
+            # back, and a late response is then dropped as unknown
+            entry = self._pending[slot]
+            if entry is not None and entry[0] == request_id:
+                self._pending[slot] = None
+                self.pending_count -= 1
+
+    async def _flusher(self):
         """
-        Listen thread function - monitors one server's stdout pipe.
-        Runs in BACKGROUND THREAD, not main thread.
+        Debounced batch sender.
+        Waits BATCH_WINDOW, then writes each server's queued requests as one
+        JSON-RPC array, one write per server.
         """
-        print(
-            f"   🧵 Listener for {server_name} started in thread: {threading.get_ident()}"
+        await asyncio.sleep(BATCH_WINDOW)
+
+        outbox, self._outbox = self._outbox, defaultdict(list)
+        self._flush_task = None
+
+        # Hand every server its payload first, then wait for all pipes together
+        sent = []
+        for server_name, batch in outbox.items():
+            writer = self._stdin_writers[server_name]
+            try:
+                self._write_batch(server_name, writer, batch)
+            except Exception as e:
+                self._fail_batch(server_name, batch, e)
+                continue
+            sent.append((server_name, batch, writer))
+            log.debug("📦 Sent batch of %d to %s", len(batch), server_name)
+
+        # ⚠️ Nobody awaits this task: a broken pipe must reach the waiting callers
+        results = await asyncio.gather(
+            *(writer.drain() for _, _, writer in sent), return_exceptions=True
         )
+        for (server_name, batch, _), result in zip(sent, results):
+            if isinstance(result, Exception):
+                self._fail_batch(server_name, batch, result)
+
+    def _fail_batch(
+        self, server_name: str, batch: List[Tuple[int, bytes]], exc: Exception
+    ):
+        """Fail the pending requests of a batch that never reached its server"""
+        log.error("❌ Sending batch to %s failed: %s", server_name, exc)
+        for request_id, _ in batch:
+            slot = request_id & PENDING_MASK
+            entry = self._pending[slot]
+            if entry is None or entry[0] != request_id:
+                continue
+            self._pending[slot] = None
+            self.pending_count -= 1
+            if not entry[2].done():
+                entry[2].set_exception(exc)
+
+    def _write_batch(
+        self,
+        server_name: str,
+        writer: asyncio.StreamWriter,
+        batch: List[Tuple[int, bytes]],
+    ):
+        """
+        Write pre-serialized frames as one JSON-RPC array.
+        While the transport has nothing buffered, the pieces go straight to
+        the pipe with os.writev, so the kernel gathers them and no joined copy
+        is built; whatever the pipe doesn't take is queued on the transport.
+        """
+        parts = [b"["]
+        for _, frame in batch:
+            parts += (frame, b",")
+        parts[-1] = b"]\n"
+
+        if (
+            HAS_WRITEV
+            and len(parts) <= IOV_MAX
+            and not writer.transport.get_write_buffer_size()
+        ):
+            try:
+                sent = os.writev(self._stdin_fds[server_name], parts)
+            except OSError:
+                sent = 0  # Pipe full or gone: let the transport handle it
+            if sent == sum(map(len, parts)):
+                return
+            writer.write(b"".join(parts)[sent:])
+            return
+
+        writer.write(b"".join(parts))
+
+    async def _listen(self, server_name: str, reader: asyncio.StreamReader):
+        """
+        Listener task - monitors one server's stdout pipe.
+        Runs on the event loop alongside every other task.
+        """
+        log.debug("🧵 Listener for %s started on the event loop", server_name)
 
         try:
-            while proc.poll() is None:  # While process is alive
-                # Read from server's stdout pipe (blocks until data arrives)
-                line = proc.stdout.readline()
-                if not line:
-                    break  # Pipe closed
+            while True:
+                # Suspends until data arrives; other tasks run meanwhile
+                head = await reader.readexactly(4)
+
+                if head == RECORD_MAGIC or head == ERROR_MAGIC:
+                    # 🔑 Binary record: fixed header, no tokenizer runs
+                    _, request_id, length = RECORD_HEADER.unpack(
+                        head + await reader.readexactly(RECORD_HEADER.size - 4)
+                    )
+                    text = (await reader.readexactly(length)).decode()
+                    if head == ERROR_MAGIC:
+                        self._resolve(server_name, request_id, None, {"message": text})
+                    else:
+                        self._resolve(
+                            server_name,
+                            request_id,
+                            {"content": [{"type": "text", "text": text}]},
+                        )
+                    continue
+
+                header = head + await reader.readline()
+                if not header.startswith(CONTENT_LENGTH):
+                    # Blank separator or stray output that isn't a framed message
+                    if header.strip():
+                        log.debug(
+                            "[%s raw] %s",
+                            server_name,
+                            header.decode(errors="replace").strip(),
+                        )
+                    continue
+
+                # 🔑 Self-delimiting frame: read exactly N bytes, no scanning for "\n"
+                length = int(header.split(b":", 1)[1])
+                await reader.readexactly(2)  # "\r\n" ending the header block
+                body = await reader.readexactly(length)
 
                 # Process the response
-                self._handle_server_response(server_name, line)
+                self._handle_server_response(server_name, body)
 
+        except asyncio.IncompleteReadError:
+            pass  # Pipe closed mid-frame
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
-            print(f"⚠️  Listener for {server_name} error: {e}")
+            log.warning("⚠️  Listener for %s error: %s", server_name, e)
 
-        print(f"⚠️  Listener for {server_name} stopped")
+        log.debug("Listener for %s stopped", server_name)
 
-    def _handle_server_response(self, server_name: str, response_line: str):
+    def _handle_server_response(self, server_name: str, response_body: bytes):
         """
         Handle response from MCP server.
-        Executes in LISTENER THREAD, not main thread.
+        Resolves the matching future; the waiting coroutine resumes with the result.
         """
         try:
-            # Parse JSON-RPC response
-            response = json.loads(response_line)
-            request_id = response.get("id")
-
-            # Thread-safe access to pending requests
-            with self.lock:
-                if request_id not in self.pending_requests:
-                    print(f"⚠️  Unknown request ID: {request_id}")
-                    return
-
-                pending = self.pending_requests[request_id]
-
-                # Verify response came from correct server
-                if pending["server"] != server_name:
-                    print(
-                        f"⚠️  Server mismatch! Expected {pending['server']}, got {server_name}"
-                    )
-                    return
-
-                # 🔑 Get the callback function object
-                callback = pending["callback"]
-
-                # Remove from pending requests
-                del self.pending_requests[request_id]
+            # Parse JSON-RPC response (an array when answering a batch)
+            response = _json_loads(response_body)
+            for item in response if isinstance(response, list) else (response,):
+                self._resolve(
+                    server_name,
+                    item.get("id"),
+                    item.get("result", {}),
+                    item.get("error"),
+                )
 
-            # 🎯 EXECUTE THE CALLBACK (in listener thread!)
-            print(
-                f"🔗 Executing callback for request {request_id} in thread {threading.get_ident()}"
+        except json.JSONDecodeError:
+            log.debug(
+                "[%s raw] %s",
+                server_name,
+                response_body.decode(errors="replace").strip(),
             )
+        except Exception as e:
+            log.error("❌ Error handling response: %s", e)
+
+    def _resolve(
+        self,
+        server_name: str,
+        request_id: int,
+        result: Optional[dict],
+        error: Optional[dict] = None,
+    ):
+        """Match one response to its pending future; a JSON-RPC error rejects it"""
+        slot = request_id & PENDING_MASK if type(request_id) is int else None
+        entry = self._pending[slot] if slot is not None else None
+        if entry is None or entry[0] != request_id:
+            log.warning("⚠️  Unknown request ID: %s", request_id)
+            return
+
+        _, expected_server, fut, created_ns = entry
+
+        # Verify response came from correct server
+        if expected_server != server_name:
+            log.warning(
+                "⚠️  Server mismatch! Expected %s, got %s", expected_server, server_name
+            )
+            return
 
-            # Pass the result data to the callback
-            callback(response.get("result", {}))
+        # Remove from pending requests
+        self._pending[slot] = None
+        self.pending_count -= 1
 
-            # ⚠️ If callback takes long, this thread is blocked!
-            # In production, you might want: threading.Thread(target=callback, args=(result,)).start()
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "⏱️  Request %d answered in %.1f ms",
+                request_id,
+                (time.monotonic_ns() - created_ns) / 1e6,
+            )
 
-        except json.JSONDecodeError:
-            print(f"[{server_name} raw] {response_line.strip()}")
-        except Exception as e:
-            print(f"❌ Error handling response: {e}")
+        # 🎯 Wake up the coroutine awaiting this request
+        if fut.done():
+            return
+        if error is not None:
+            fut.set_exception(
+                RuntimeError(f"{server_name} error: {error.get('message', error)}")
+            )
+        else:
+            fut.set_result(result)
 
     # ========== HELPER METHODS ==========
 
     def _update_ui(self, message: str):
         """Simulate UI update"""
         self.results_queue.append(message)
-        print(f"💻 UI Updated: {message}")
+        log.debug("💻 UI Updated: %s", message)
 
     def _suggest_action(self, suggestion: str):
         """Simulate action suggestion"""
         print(f"💡 Suggestion: {suggestion}")
 
-    def cleanup(self):
+    async def cleanup(self):
         """Clean up all server processes"""
         print("\n🧹 Cleaning up...")
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        for task in self._listeners.values():
+            task.cancel()
+        self._exec.shutdown(wait=False)
+        for writer in self._stdin_writers.values():
+            writer.close()
         for name, proc in self.mcp_servers.items():
-            if proc.poll() is None:
+            if proc.is_alive():
                 proc.terminate()
+                await asyncio.to_thread(proc.join)
                 print(f"   Stopped {name} server")
 
 
 # ========== SIMULATED MCP SERVERS ==========
 
-WEATHER_MCP_CODE = '''
-"""
-Simulated Weather MCP Server
-Responds with random weather data
-"""
-import sys, json, time, random
 
-print("🌤️  Weather MCP Server started", file=sys.stderr)
+def _serve(stdin_conn, stdout_conn, banner: str, tool):
+    """
+    JSON-RPC loop shared by the simulated servers, run in the server process.
+    tool(arguments) returns the result text of one tools/call request.
+    """
+    stdin = _pipe_file(stdin_conn, "rb")
+    stdout = _pipe_file(stdout_conn, "wb")
+
+    # Set by the client's "register" notification: reply with binary records
+    # (magic, request ID, payload length) + UTF-8 text instead of JSON-RPC
+    binary = False
+
+    def reply(request_id, text):
+        """Response to one tool call in the registered format"""
+        if binary:
+            data = text.encode()
+            return RECORD_HEADER.pack(RECORD_MAGIC, request_id, len(data)) + data
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "result": {"content": [{"type": "text", "text": text}]},
+        }
 
-while True:
-    try:
-        line = sys.stdin.readline()
-        if not line:
-            break
-        
-        request = json.loads(line)
-        
-        if request["method"] == "tools/call":
-            city = request["params"]["arguments"]["city"]
-            
-            # Simulate API delay
-            delay = random.uniform(0.3, 1.2)
-            time.sleep(delay)
-            
-            # Generate random weather
-            temp = random.randint(15, 30)
-            conditions = ["sunny", "cloudy", "rainy", "windy"]
-            condition = random.choice(conditions)
-            
-            response = {
-                "jsonrpc": "2.0",
-                "id": request["id"],
-                "result": {
-                    "content": [{
-                        "type": "text",
-                        "text": f"{city}: {temp}°C, {condition}"
-                    }]
-                }
-            }
-            
-            print(json.dumps(response), flush=True)
-            
-    except Exception as e:
-        print(f"Error: {e}", file=sys.stderr)
-'''
-
-STOCK_MCP_CODE = '''
-"""
-Simulated Stock MCP Server  
-Responds with stock prices
-"""
-import sys, json, time, random
+    def send(response):
+        """Write binary records as-is, or one Content-Length framed JSON message"""
+        if binary:
+            out = b"".join(response) if isinstance(response, list) else response
+        else:
+            body = _json_dumps(response)
+            out = b"Content-Length: %d\r\n\r\n" % len(body) + body
+        stdout.write(out)
+        stdout.flush()
+
+    def fail(request, exc):
+        """Error response for one request whose handling raised, or None"""
+        if not isinstance(request, dict) or "id" not in request:
+            return None  # Notifications get no response
+        request_id = request["id"]
+        message = f"{type(exc).__name__}: {exc}"
+        if binary:
+            if type(request_id) is not int:
+                return None  # No request ID to address a binary record to
+            data = message.encode()
+            return RECORD_HEADER.pack(ERROR_MAGIC, request_id, len(data)) + data
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": -32603, "message": message},
+        }
 
-print("📈 Stock MCP Server started", file=sys.stderr)
+    def handle_one(request):
+        """handle() for one request: a failure only costs that request"""
+        try:
+            return handle(request)
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return fail(request, e)
+
+    def handle(request):
+        """Handle one JSON-RPC request; returns the response or None"""
+        nonlocal binary
+        if request["method"] == "register":
+            binary = True
+            return None
+        if request["method"] != "tools/call":
+            return None
+        return reply(request["id"], tool(request["params"]["arguments"]))
 
-stock_prices = {
-    "AAPL": 182.63,
-    "TSLA": 175.79,
-    "MSFT": 407.81,
-    "GOOGL": 148.32
-}
+    print(banner, file=sys.stderr)
 
-while True:
-    try:
-        line = sys.stdin.readline()
-        if not line:
-            break
-        
-        request = json.loads(line)
-        
-        if request["method"] == "tools/call":
-            symbol = request["params"]["arguments"]["symbol"]
-            
-            # Simulate API delay
-            delay = random.uniform(0.2, 0.8)
-            time.sleep(delay)
-            
-            # Get price with small random variation
-            base_price = stock_prices.get(symbol, 100.0)
-            variation = random.uniform(-2.0, 2.0)
-            price = round(base_price + variation, 2)
-            
-            response = {
-                "jsonrpc": "2.0",
-                "id": request["id"],
-                "result": {
-                    "content": [{
-                        "type": "text",
-                        "text": f"{symbol}: ${price}"
-                    }]
-                }
-            }
-            
-            print(json.dumps(response), flush=True)
-            
-    except Exception as e:
-        print(f"Error: {e}", file=sys.stderr)
-'''
+    while True:
+        try:
+            line = stdin.readline()
+            if not line:
+                break
+
+            request = _json_loads(line)
+
+            # JSON-RPC 2.0 batch: an array of requests gets an array of responses
+            if isinstance(request, list):
+                responses = [r for r in map(handle_one, request) if r is not None]
+                if responses:
+                    send(responses)
+            else:
+                response = handle_one(request)
+                if response is not None:
+                    send(response)
+
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+
+
+def _weather_tool(arguments: dict) -> str:
+    """get_weather: random weather for a city"""
+    city = arguments["city"]
+
+    # Simulate API delay
+    delay = random.uniform(0.3, 1.2)
+    time.sleep(delay)
+
+    # Generate random weather
+    temp = random.randint(15, 30)
+    conditions = ["sunny", "cloudy", "rainy", "windy"]
+    condition = random.choice(conditions)
+
+    return f"{city}: {temp}°C, {condition}"
+
+
+stock_prices = {"AAPL": 182.63, "TSLA": 175.79, "MSFT": 407.81, "GOOGL": 148.32}
+
+
+def _stock_tool(arguments: dict) -> str:
+    """get_stock_price: quoted price with a small random variation"""
+    symbol = arguments["symbol"]
+
+    # Simulate API delay
+    delay = random.uniform(0.2, 0.8)
+    time.sleep(delay)
+
+    # Get price with small random variation
+    base_price = stock_prices.get(symbol, 100.0)
+    variation = random.uniform(-2.0, 2.0)
+    price = round(base_price + variation, 2)
+
+    return f"{symbol}: ${price}"
+
+
+def weather_main(stdin_conn, stdout_conn):
+    """Simulated Weather MCP Server - responds with random weather data"""
+    _serve(stdin_conn, stdout_conn, "🌤️  Weather MCP Server started", _weather_tool)
 
 
-def create_mcp_server_files():
-    """Create simulated MCP server files for testing"""
-    with open("weather_mcp.py", "w") as f:
-        f.write(WEATHER_MCP_CODE)
+def stock_main(stdin_conn, stdout_conn):
+    """Simulated Stock MCP Server - responds with stock prices"""
+    _serve(stdin_conn, stdout_conn, "📈 Stock MCP Server started", _stock_tool)
 
-    with open("stock_mcp.py", "w") as f:
-        f.write(STOCK_MCP_CODE)
 
-    print("📁 Created MCP server files")
+# MCP servers to launch: (server name, process entry point)
+SERVERS = (
+    ("weather", weather_main),
+    ("stock", stock_main),
+)
 
 
 # ========== MAIN DEMONSTRATION ==========
 
 
-def main():
+async def main():
     """Main demonstration function"""
+    # Show the request/response flow; use logging.WARNING to drop the chatter
+    log_listener = start_logging(logging.DEBUG)
+
     print("=" * 60)
     print("AI APP WITH MCP SERVERS - COMPLETE DEMONSTRATION")
     print("=" * 60)
 
-    # Create MCP server files
-    create_mcp_server_files()
-
     # Create AI agent
     agent = MyAIAgent()
 
-    # Start MCP servers (starts subprocesses and listener threads)
-    agent.start_mcp_servers()
-
-    print("\n" + "=" * 60)
-    print("DEMONSTRATION: Concurrent Requests with Callbacks")
-    print("=" * 60)
-
-    # Give servers time to start
-    time.sleep(0.5)
+    # Cleanup runs even if startup or a question blows up
+    try:
+        # Start MCP servers (starts subprocesses and listener tasks)
+        await agent.start_mcp_servers()
 
-    # 🔥 Key demonstration: Make concurrent requests
-    print("\n1️⃣  Making CONCURRENT requests (main thread doesn't block):")
-    print("   Main thread continues immediately after each call!")
+        print("\n" + "=" * 60)
+        print("DEMONSTRATION: Concurrent Requests on One Event Loop")
+        print("=" * 60)
 
-    agent.ask_question("Beijing weather")
-    print("   Main: Immediately continued after Beijing request")
+        # Give servers time to start
+        await asyncio.sleep(0.5)
 
-    agent.ask_question("Shanghai weather")
-    print("   Main: Immediately continued after Shanghai request")
+        # 🔥 Key demonstration: Make concurrent requests
+        print("\n1️⃣  Making CONCURRENT requests (main coroutine doesn't block):")
+        print("   Main continues immediately after scheduling each question!")
 
-    agent.ask_question("Apple stock price")
-    print("   Main: Immediately continued after Apple request")
+        tasks = []
 
-    agent.ask_question("Tesla stock price")
-    print("   Main: Immediately continued after Tesla request")
+        tasks.append(asyncio.create_task(agent.ask_question("Beijing weather")))
+        print("   Main: Immediately continued after Beijing request")
 
-    print("\n📊 Main thread free to handle user input while waiting for responses...")
+        tasks.append(asyncio.create_task(agent.ask_question("Shanghai weather")))
+        print("   Main: Immediately continued after Shanghai request")
 
-    # Wait for all callbacks to complete
-    print("\n⏳ Waiting for responses (callbacks execute in listener threads)...")
-    time.sleep(3)
+        tasks.append(asyncio.create_task(agent.ask_question("Apple stock price")))
+        print("   Main: Immediately continued after Apple request")
 
-    # Show what happened
-    print("\n" + "=" * 60)
-    print("RESULTS SUMMARY")
-    print("=" * 60)
+        tasks.append(asyncio.create_task(agent.ask_question("Tesla stock price")))
+        print("   Main: Immediately continued after Tesla request")
 
-    print(f"\n📋 Results in queue: {len(agent.results_queue)} items")
-    for result in agent.results_queue:
-        print(f"   • {result}")
+        print(
+            "\n📊 Main coroutine free to handle user input"
+            " while waiting for responses..."
+        )
 
-    # Check for pending requests
-    with agent.lock:
-        if agent.pending_requests:
-            print(f"\n⚠️  {len(agent.pending_requests)} requests still pending")
+        # Wait for all results to come back: returns as soon as the last one lands
+        print("\n⏳ Waiting for responses (listener tasks resolve the futures)...")
+        # return_exceptions: one failed question must not hide the other answers
+        try:
+            outcomes = await asyncio.wait_for(
+                asyncio.gather(*tasks, return_exceptions=True), timeout=10
+            )
+        except asyncio.TimeoutError:
+            # wait_for has cancelled the unanswered questions: those failed
+            print("⚠️  Timed out waiting for responses")
+            outcomes = [
+                asyncio.TimeoutError("no answer") if t.cancelled() else t.exception()
+                for t in tasks
+            ]
+        failures = [e for e in outcomes if isinstance(e, BaseException)]
+        for e in failures:
+            print(f"❌ Question failed: {type(e).__name__}: {e}")
+
+        # Show what happened
+        print("\n" + "=" * 60)
+        print("RESULTS SUMMARY")
+        print("=" * 60)
+
+        # Snapshot first: worker threads may still append while we iterate
+        results = list(agent.results_queue)
+        print(f"\n📋 Results in queue: {len(results)} items")
+        for result in results:
+            print(f"   • {result}")
+
+        # Check for pending requests
+        if agent.pending_count:
+            print(f"\n⚠️  {agent.pending_count} requests still pending")
+        elif failures:
+            print(f"\n⚠️  {len(failures)} requests failed")
         else:
             print("\n✅ All requests completed successfully!")
-
-    # Cleanup
-    agent.cleanup()
+    finally:
+        await agent.cleanup()
+        log_listener.stop()
 
     print("\n" + "=" * 60)
     print("DEMONSTRATION COMPLETE")
@@ -511,4 +888,13 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # Use uvloop's libuv-based loop when available; it cuts per-event overhead
+    # for pipe-heavy subprocess IPC like this demo
+    try:
+        import uvloop
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+    asyncio.run(main())